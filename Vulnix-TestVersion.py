@@ -10,21 +10,63 @@ Merci de vous intéresser à Vulnix :)
 import sys
 import os
 import json
+import re
+import html
 import argparse
 import subprocess
+import signal
 import shutil
+import shlex
 import platform
-import datetime
 import time
+import heapq
+import hashlib
+import itertools
+import importlib.util
 from pathlib import Path
+from collections import Counter
+from functools import lru_cache
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 
 # === CONFIGURATION CONSTANTS ===
 TOOL_NAME = "VULNIX"
 VERSION = "2.3.0-STABLE"
 DEFAULT_MODEL = "gemini-1.5-flash"
+MAX_INPUT_TOKENS = 1_000_000  # Gemini 1.5 context window
 VENV_NAME = "trivy_env"
-REQUIRED_PACKAGES = ["google-generativeai", "rich", "pyfiglet", "questionary", "jinja2"]
+HOME = Path.home()  # resolved once, reused by every path below
+IS_WINDOWS = platform.system() == "Windows"  # resolved once, not per call site
+IS_WSL = "WSL_DISTRO_NAME" in os.environ
+WINDOWS_SYSTEM_PROFILES = frozenset(("Public", "Default", "Default User", "All Users"))
+CACHE_DIR = HOME / ".cache" / "vulnix"
+FIX_CACHE_DIR = CACHE_DIR / "fix_cache"
+MODEL_CACHE_FILE = CACHE_DIR / "model.json"
+MODEL_CACHE_TTL = 24 * 3600  # the model list changes rarely, re-check once a day
+# Trivy's vulnerability DB (~80 MB): one persistent location, re-downloaded only when stale.
+# Vulnix-owned: "sudo trivy" writes root-owned files here, so it must not be the user's
+# own ~/.cache/trivy (their plain trivy runs would then fail to update the DB).
+TRIVY_CACHE_DIR = CACHE_DIR / "trivy"
+TRIVY_DB_TTL = 6 * 3600  # upstream publishes a new DB every 6 hours
+# Scan cache (fs, or redis://... shared between hosts): unchanged files are not re-analyzed.
+# Passed as a flag because sudo drops TRIVY_* variables from the environment.
+TRIVY_CACHE_BACKEND = os.environ.get("TRIVY_CACHE_BACKEND", "fs")
+GEMINI_TIMEOUT = 120  # seconds; a stalled request must not hang the run forever
+SEVERITY_LEVELS = frozenset(("CRITICAL", "HIGH", "MEDIUM", "LOW", "UNKNOWN"))
+# Canonical (shared) string per severity: one dict lookup validates and interns it
+_SEV_CANON = {sev: sev for sev in SEVERITY_LEVELS}
+SEVERITY_RANK = {"CRITICAL": 4, "HIGH": 3, "MEDIUM": 2, "LOW": 1, "UNKNOWN": 0}
+LIGHT_SCAN_DIRS = ["/bin", "/sbin", "/usr/bin", "/etc"]
+# Never walked by the full "/" scan: virtual filesystems, other mounts (/mnt/c on WSL),
+# container storage and package caches. Huge, no installed packages, OOM-prone.
+SKIP_DIRS = ",".join([
+    "/proc", "/sys", "/dev", "/run", "/snap", "/mnt", "/media",
+    "/var/lib/docker", "/var/lib/containerd", "/var/cache/apt/archives",
+])
+REQUIRED_PACKAGES = ["google-generativeai", "rich", "pyfiglet", "questionary", "jinja2", "orjson", "ijson", "packaging"]
+# Import names of REQUIRED_PACKAGES (same order)
+REQUIRED_MODULES = ["google.generativeai", "rich", "pyfiglet", "questionary", "jinja2", "orjson", "ijson", "packaging"]
 
 # === BOOTSTRAP: VIRTUAL ENVIRONMENT HANDLING ===
 def bootstrap_venv():
@@ -39,48 +81,75 @@ def bootstrap_venv():
     if os.environ.get("VULNIX_BOOTSTRAPPED") == "1":
         return
 
-    venv_dir = Path.home() / VENV_NAME
+    # Everything already importable here (system/user install, another venv): no venv
+    # and no re-exec. find_spec only locates the modules, it doesn't import them.
+    try:
+        if all(importlib.util.find_spec(m) for m in REQUIRED_MODULES):
+            return
+    except ImportError: pass
+
+    venv_dir = HOME / VENV_NAME
     
-    # Determine paths
-    if platform.system() == "Windows":
-        venv_python = venv_dir / "Scripts" / "python.exe"
-        venv_pip = venv_dir / "Scripts" / "pip.exe"
-    else:
-        venv_python = venv_dir / "bin" / "python"
-        venv_pip = venv_dir / "bin" / "pip"
+    # Determine paths (stringified once: they only feed argv/env below)
+    venv_str = str(venv_dir)
+    venv_bin = os.path.join(venv_str, "Scripts" if IS_WINDOWS else "bin")
+    venv_python = os.path.join(venv_bin, "python.exe" if IS_WINDOWS else "python")
+    venv_pip = os.path.join(venv_bin, "pip.exe" if IS_WINDOWS else "pip")
 
     # Check if we are running inside the correct venv
     # We use sys.prefix match OR explicit environment variable check
-    is_in_venv = sys.prefix == str(venv_dir)
+    is_in_venv = sys.prefix == venv_str
     
     if not is_in_venv:
         if not venv_dir.exists():
             print(f"[*] Initializing virtual environment at {venv_dir}...")
             try:
-                subprocess.run([sys.executable, "-m", "venv", str(venv_dir)], check=True)
+                subprocess.run([sys.executable, "-m", "venv", venv_str], check=True)
             except subprocess.CalledProcessError:
                 print("[!] Critical: Failed to create venv. Install 'python3-venv'.")
                 sys.exit(1)
 
         # Check and install dependencies
-        try:
-            subprocess.run([str(venv_python), "-c", "import rich; import questionary; import google.generativeai; import jinja2"], 
-                           check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        except subprocess.CalledProcessError:
-            print("[*] Installing dependencies (This may take a minute)...")
-            subprocess.run([str(venv_python), "-m", "pip", "install", "--upgrade", "pip"], check=True)
-            subprocess.run([str(venv_pip), "install"] + REQUIRED_PACKAGES, check=True)
+        # A marker written after a verified install skips the import probe (a full
+        # interpreter start) on every later launch. Stamped with the version and the
+        # package list: a new release or a new dependency re-checks.
+        deps_marker = venv_dir / ".vulnix_deps_ok"
+        deps_stamp = f"{VERSION}:{hashlib.sha1(repr(sorted(REQUIRED_PACKAGES)).encode()).hexdigest()[:8]}"
+        try: deps_ok = deps_marker.read_text(errors="ignore") == deps_stamp
+        except OSError: deps_ok = False
+
+        if not deps_ok:
+            # Metadata lookup only: checks every REQUIRED_PACKAGES entry without importing
+            # rich/prompt_toolkit/google (most of the probe's cost).
+            probe = f"import importlib.metadata as m; [m.version(p) for p in {REQUIRED_PACKAGES!r}]"
+            try:
+                subprocess.run([venv_python, "-c", probe],
+                               check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except subprocess.CalledProcessError:
+                print("[*] Installing dependencies (This may take a minute)...")
+                # Progress chatter goes to /dev/null, errors (stderr) stay visible.
+                # One pip run (no pip self-upgrade); wheels are preferred over sdist builds.
+                subprocess.run([venv_pip, "install", "--prefer-binary", "--disable-pip-version-check"] + REQUIRED_PACKAGES,
+                               check=True, stdout=subprocess.DEVNULL)
+            deps_marker.write_text(deps_stamp)
 
         print("[*] Loading VULNIX Engine...")
+        # Re-launch script inside the venv
+        # We explicitly set Bootstrapped flag to prevent loop
+        env = os.environ.copy()
+        env["VIRTUAL_ENV"] = venv_str
+        env["PATH"] = venv_bin + os.pathsep + env["PATH"]
+        env["VULNIX_BOOTSTRAPPED"] = "1"
+        argv = [venv_python, __file__] + sys.argv[1:]
+
+        if not IS_WINDOWS:
+            # Replace this process in place: no second interpreter kept alive waiting.
+            sys.stdout.flush()
+            os.execve(argv[0], argv, env)
+
+        # Windows has no real exec (os.exec* spawns and detaches): keep the child + wait.
         try:
-            # Re-launch script inside the venv
-            # We explicitly set Bootstrapped flag to prevent loop
-            env = os.environ.copy()
-            env["VIRTUAL_ENV"] = str(venv_dir)
-            env["PATH"] = str(venv_dir / "bin") + os.pathsep + env["PATH"]
-            env["VULNIX_BOOTSTRAPPED"] = "1"
-            
-            subprocess.run([str(venv_python), __file__] + sys.argv[1:], check=True, env=env)
+            subprocess.run(argv, check=True, env=env)
             sys.exit(0)
         except subprocess.CalledProcessError as e:
             sys.exit(e.returncode)
@@ -89,15 +158,369 @@ def bootstrap_venv():
 bootstrap_venv()
 
 # === IMPORTS (Available only after bootstrap) ===
-import google.generativeai as genai
+# Heavy modules (google.generativeai, pyfiglet, questionary, jinja2) are imported
+# where they are used, so automation runs don't pay for the ones they never touch.
 from rich.console import Console
 from rich.panel import Panel
 from rich.text import Text
 from rich.table import Table
-from rich.progress import Progress, SpinnerColumn, TextColumn
-import pyfiglet
-import questionary
-from jinja2 import Template
+import ijson
+
+# Summary table labels, built once: Text objects skip Rich's markup parser.
+_SEV_LABELS = {
+    "CRITICAL": Text("CRITICAL", style="bold red"),
+    "HIGH": Text("HIGH", style="red"),
+    "MEDIUM": Text("MEDIUM", style="yellow"),
+    "LOW": Text("LOW", style="green"),
+    "TOTAL": Text("TOTAL", style="bold white"),
+}
+
+# packaging: PEP 440 ordering for Python fixed versions. Optional, like orjson:
+# _version_key falls back to a generic ordering without it.
+try:
+    from packaging.version import Version, InvalidVersion
+except ImportError:
+    Version = None
+
+# orjson (Rust) is much faster than stdlib json on large Trivy reports.
+# Optional: older venvs may not have it, so we fall back to stdlib json.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_loads(data):
+    """Parses JSON from bytes/str, with orjson if available."""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def json_dumps(obj):
+    """Serializes to a JSON str, with orjson if available."""
+    return orjson.dumps(obj).decode() if orjson else json.dumps(obj, separators=(",", ":"))
+
+@contextmanager
+def atomic_open(path, mode=None):
+    """Opens a temp file next to `path` for text writing; renames it over `path` on success."""
+    # A crash or Ctrl+C never leaves a truncated report/script behind. Permissions follow
+    # the umask like a plain open(); an explicit `mode` (the 0755 fix script) is set on
+    # the fd before the file becomes visible (no chmod race).
+    tmp = f"{path}.{os.getpid()}.tmp"  # per-process: concurrent runs never share a temp file
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        if mode is not None and hasattr(os, "fchmod"): os.fchmod(fd, mode)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            yield f
+            # Data on disk before the rename: after a power loss the file is either the
+            # old one or the complete new one, never an empty/torn replacement.
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try: os.unlink(tmp)
+        except OSError: pass
+        raise
+
+# --- INTELLIGENCE V3 : DÉDOUBLONNAGE + RECHERCHE DE FICHIER ---
+# Constant preamble of the Gemini prompt (built once at import, not per call).
+# Sent as the model's system instruction, separate from the per-scan vulnerability list.
+FIX_SYSTEM_PROMPT = """
+        You are an expert Senior Linux System Administrator.
+        Your task is to generate a ROBUST Bash script to remediate vulnerabilities found in a Trivy JSON scan.
+
+        ### INPUT CONTEXT
+        The script will receive the path to the Trivy JSON report as the first argument ($1).
+
+        ### REQUIREMENTS:
+        1. **SCRIPT HEADER**:
+           - Start with `#!/bin/bash`.
+           - Use `set -eo pipefail` (NO `set -u`).
+           - Wrap logic in `main()`.
+
+        2. **PYTHON PARSING (THE BRAIN)**: 
+           - Use `python3 - "$1" <<EOF` to pass the filename.
+           - **LOGIC CHANGE - DEDUPLICATION**: 
+             - You must parse ALL vulnerabilities.
+             - Store them in a dictionary: `updates[package_name] = (max_fixed_version, target_file)`.
+             - Only keep the HIGHEST version required for each package to avoid multiple useless updates.
+             - Print the unique list: `pkg|ver|file`.
+           - **Syntax**: Use `f"{chr(44).join(list)}"` for output.
+
+        3. **REMEDIATION LOOP**:
+           - Loop through the **unique** list.
+           - `python3 -m pip install --upgrade --break-system-packages --ignore-installed "${pkg}==${ver}"`.
+           - Track success (`UPDATED_PACKAGES`) and failure (`MANUAL_ACTION_REQUIRED`).
+
+        4. **SMART FILE FINDER (The Limier)**:
+           - After update, verify persistence in `$target_file`.
+           - **CRITICAL LOGIC**: 
+             - If `[ ! -f "$target_file" ]`, try to find it!
+             - Run: `found_file=$(find . -type f -name "$(basename "$target_file")" -print -quit)`
+             - If found, use `$found_file` as the new target.
+             - If still not found, try searching inside `/home/$USER/`.
+           - Once file is located, `grep` for the old version.
+           - If old version exists in file -> Add to `MANUAL_ACTION_REQUIRED`.
+
+        5. **FINAL REPORT**:
+           - Print "REMEDIATION SUMMARY".
+           - List runtime successes.
+           - List persistence mismatches explicitly: "⚠️  File [path] still contains [pkg] [old_ver]".
+
+        6. **FORBIDDEN PATTERNS (SAFETY)**:
+           - NEVER use `rm -rf`, `dd`, `mkfs`, or delete anything outside of package manager operations.
+           - NEVER pipe a download into a shell (`curl ... | bash`, `wget -O- ... | sh`).
+           - NEVER edit the application files (requirements.txt, package.json, ...): only REPORT mismatches.
+           - NEVER run `apt-get dist-upgrade`, `reboot` or `shutdown`.
+           - Upgrade ONE package at a time, pinned to its fixed version: the exact pip command of section 3 for Python packages, `apt-get install --only-upgrade -y <pkg>` for OS packages.
+
+        7. **OUTPUT**:
+           - Return ONLY the raw Bash script.
+        """
+
+# === HTML DASHBOARD TEMPLATE ===
+HTML_TEMPLATE = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>VULNIX Executive Dashboard</title>
+    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
+    <style>
+        :root { --bg: #0f172a; --card-bg: #1e293b; --text: #f8fafc; --accent: #3b82f6; --critical: #ef4444; --high: #f97316; --medium: #eab308; --low: #22c55e; }
+        body { font-family: 'Segoe UI', system-ui, sans-serif; background: var(--bg); color: var(--text); margin: 0; padding: 20px; }
+        .container { max-width: 1200px; margin: 0 auto; }
+        .header { display: flex; justify-content: space-between; align-items: center; margin-bottom: 30px; border-bottom: 2px solid var(--accent); padding-bottom: 10px; }
+        .grid { display: grid; grid-template-columns: 1fr 2fr; gap: 20px; margin-bottom: 30px; }
+        .card { background: var(--card-bg); padding: 20px; border-radius: 12px; box-shadow: 0 4px 6px -1px rgba(0,0,0,0.5); }
+        .stat-card { text-align: center; padding: 15px; background: rgba(255,255,255,0.05); border-radius: 8px; margin-bottom: 10px; }
+        .stat-num { font-size: 2em; font-weight: bold; }
+        .vuln-table { width: 100%; border-collapse: collapse; margin-top: 20px; }
+        .vuln-table th, .vuln-table td { text-align: left; padding: 12px; border-bottom: 1px solid #334155; }
+        .vuln-table th { background: #334155; color: white; cursor: pointer; }
+        .badge { padding: 4px 8px; border-radius: 4px; font-size: 0.85em; font-weight: bold; color: #000; }
+        .bg-CRITICAL { background: var(--critical); } .bg-HIGH { background: var(--high); }
+        .bg-MEDIUM { background: var(--medium); } .bg-LOW { background: var(--low); }
+        input#search { width: 100%; padding: 10px; border-radius: 6px; border: 1px solid #475569; background: #0f172a; color: white; margin-bottom: 10px; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>🛡 VULNIX Executive Report</h1>
+            <p>{{ timestamp }}</p>
+        </div>
+
+        <div class="grid">
+            <div class="card">
+                <h3>Vulnerability Overview</h3>
+                <canvas id="vulnChart"></canvas>
+            </div>
+            <div class="card">
+                <h3>Summary</h3>
+                <div class="stat-card">
+                    <div class="stat-num" style="color: var(--critical)">{{ stats.CRITICAL }}</div>
+                    <div>Critical Issues</div>
+                </div>
+                <div class="stat-card">
+                    <div class="stat-num" style="color: var(--high)">{{ stats.HIGH }}</div>
+                    <div>High Priority</div>
+                </div>
+                <div class="stat-card">
+                    <div class="stat-num">{{ stats.MEDIUM_LOW }}</div>
+                    <div>Other Risks</div>
+                </div>
+            </div>
+        </div>
+
+        <div class="card">
+            <h3>Detailed Findings</h3>
+            <input type="text" id="search" placeholder="Search vulnerabilities..." onkeyup="searchTable()">
+            <table class="vuln-table" id="vulnTable">
+                <thead>
+                    <tr onclick="sortTable(0)"><th>ID</th><th>Severity</th><th>Package</th><th>Version</th><th>Title</th></tr>
+                </thead>
+                <tbody>
+                    {%+ for row in rows %}{{ row | safe }}{% endfor +%}
+                </tbody>
+            </table>
+        </div>
+    </div>
+
+    <script>
+        // Pie Chart
+        const ctx = document.getElementById('vulnChart').getContext('2d');
+        new Chart(ctx, {
+            type: 'doughnut',
+            data: {
+                labels: ['Critical', 'High', 'Medium', 'Low'],
+                datasets: [{
+                    data: [{{ stats.CRITICAL }}, {{ stats.HIGH }}, {{ stats.MEDIUM }}, {{ stats.LOW }}],
+                    backgroundColor: ['#ef4444', '#f97316', '#eab308', '#22c55e'],
+                    borderWidth: 0
+                }]
+            },
+            options: { plugins: { legend: { position: 'bottom', labels: { color: 'white' } } } }
+        });
+
+        // Search Function
+        function searchTable() {
+            const input = document.getElementById("search");
+            const filter = input.value.toUpperCase();
+            const table = document.getElementById("vulnTable");
+            const tr = table.getElementsByTagName("tr");
+            for (let i = 1; i < tr.length; i++) {
+                tr[i].style.display = tr[i].textContent.toUpperCase().includes(filter) ? "" : "none";
+            }
+        }
+    </script>
+</body>
+</html>
+"""
+
+# One <tr> per vulnerability, filled with plain str.format: on reports with thousands
+# of CVEs a Jinja {% for %} loop (context push/pop + attribute lookups per cell)
+# dominates the render time.
+HTML_ROW_TEMPLATE = (
+    '<tr><td>{id}</td><td><span class="badge bg-{sev}">{sev}</span></td>'
+    '<td>{pkg}</td><td>{version}</td><td>{title}</td></tr>\n'
+)
+
+# Trivy result types whose versions follow PEP 440 (compared with packaging.version)
+PYPI_TYPES = frozenset(("pip", "pipenv", "poetry", "python-pkg", "uv"))
+_VERSION_TOKEN_RE = re.compile(r"\d+|[A-Za-z]+|~")
+# Pre-release words (and dpkg's "~") sort *before* the end of the version: 2.0.0~rc1 < 2.0.0
+_PRE_RELEASE_TOKENS = frozenset(("~", "alpha", "beta", "rc", "pre", "preview", "dev"))
+
+@lru_cache(maxsize=None)
+def _version_key(version, ecosystem=""):
+    """Sort key picking the highest fixed version ("1.1.1t" < "1.1.1w", "2.0.0-rc1" < "2.0.0")."""
+    # PyPI: real PEP 440 ordering when packaging is available. Elsewhere (deb, rpm, apk...)
+    # digit runs compare as numbers, letter runs as text, pre-release markers below the
+    # end of the version, after the deb/rpm epoch ("1:2.3" > "2.4", missing epoch = 0).
+    # The raw string breaks remaining ties: distinct versions never compare equal, so the
+    # pick doesn't depend on report order.
+    if Version is not None and ecosystem in PYPI_TYPES:
+        try: return (1, Version(version), (), version)
+        except InvalidVersion: pass
+    epoch, sep, rest = version.partition(":")
+    if not (sep and epoch.isdigit()): epoch, rest = "0", version
+    tokens = tuple(
+        (2, int(t)) if t.isdigit() else (-1, t) if t.lower() in _PRE_RELEASE_TOKENS else (1, t)
+        for t in _VERSION_TOKEN_RE.findall(rest)
+    )
+    return (0, int(epoch), tokens + ((0, ""),), version)
+
+# Bounded: package names and versions repeat across rows, titles mostly don't and
+# would otherwise stay in memory for the life of the process.
+@lru_cache(maxsize=4096)
+def _escape(value):
+    """HTML-escapes a field, reusing the result for recently seen values."""
+    return html.escape(str(value))
+
+def render_html_rows(vulnerabilities):
+    """Yields the dashboard table rows (HTML-escaped) one by one."""
+    return (
+        HTML_ROW_TEMPLATE.format(
+            id=_escape(v["VulnerabilityID"]),
+            sev=v["Severity"],
+            pkg=_escape(v["PkgName"]),
+            version=_escape(v["InstalledVersion"]),
+            title=_escape(v["Title"]),
+        )
+        for v in vulnerabilities
+    )
+
+@lru_cache(maxsize=None)
+def get_html_template():
+    """Parses and compiles the dashboard template once; later calls only render."""
+    from jinja2 import Environment
+    # autoescape protects the dashboard from markup inside CVE titles.
+    env = Environment(autoescape=True, trim_blocks=True, lstrip_blocks=True)
+    return env.from_string(HTML_TEMPLATE)
+
+# === DRY-RUN CLASSIFIER ===
+# 1. Liste des commandes à surveiller
+DANGEROUS_COMMANDS = [
+    "apt-get", "apt", "yum", "dnf", "apk", "pacman", "zypper",
+    "rm ", "mv ", "cp ", "sed ", "chmod ", "chown ", "dd ",
+    "systemctl", "service", "pip ", "npm ", "yarn ", "poetry ",
+    "wget", "curl", "dpkg", "rpm"
+]
+
+# 2. Liste des caractères qui signalent une complexité
+# Si une ligne contient l'un de ces caractères, on ne la touche pas pour éviter les erreurs de syntaxe.
+# ; = fin de commande
+# | = pipe
+# & = logique
+# ( ) = sous-shell
+# \ = multiligne
+# { } = bloc
+COMPLEX_MARKERS = [";", "|", "&", "(", ")", "{", "}", "\\", "`", "if ", "then", "else", "elif", "fi", "do", "done", "case", "esac"]
+
+# Compiled once: a single C-level regex scan per line instead of ~40 Python substring tests.
+_COMPLEX_RE = re.compile("|".join(re.escape(m) for m in COMPLEX_MARKERS))
+_DANGEROUS_RE = re.compile("(?:" + "|".join(re.escape(c) for c in DANGEROUS_COMMANDS) + ")")
+# Indented line, blank line or comment: never wrapped
+_KEEP_LINE_RE = re.compile(r"[ \t]|\s*(?:#|$)")
+
+# Fonction de confirmation, définie une seule fois en tête du script : chaque commande
+# surveillée devient un simple appel `vulnix_ask '<commande>' "$@"` (au lieu d'un bloc de 4 lignes).
+# The script's own arguments are forwarded after the command, so "$1" (the report path)
+# still means the same thing inside the eval. The if/fi keeps the return code 0 on "no",
+# so `set -e` scripts keep running.
+DRY_RUN_HELPER = (
+    'vulnix_ask() {\n'
+    '    local cmd=$1; shift\n'
+    '    read -p "[DRY-RUN] Execute: $cmd? [y/N] " confirm\n'
+    '    if [[ $confirm == [yY] || $confirm == [yY]es ]]; then eval "$cmd"; fi\n'
+    '}'
+)
+
+# === GEMINI CLIENT ===
+# One configured client and one model object per process: several automators in the
+# same interpreter (batch/CI runs) reuse the transport instead of rebuilding it.
+@lru_cache(maxsize=None)
+def configure_genai(api_key):
+    """Configures google.generativeai once per API key and returns the module."""
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai
+
+@lru_cache(maxsize=4)
+def get_genai_model(model_name):
+    """Returns the (shared) GenerativeModel for `model_name`, with the fix instructions."""
+    import google.generativeai as genai
+    return genai.GenerativeModel(model_name, system_instruction=FIX_SYSTEM_PROMPT)
+
+# === WSL ===
+@lru_cache(maxsize=None)
+def wsl_user_profile():
+    """Asks Windows for %USERPROFILE% (cmd.exe, then wslpath) once; None on failure."""
+    # Two plain argv calls, no intermediate shell.
+    try:
+        win_profile = subprocess.run(["cmd.exe", "/c", "echo %USERPROFILE%"], capture_output=True, text=True).stdout.strip()
+        if not win_profile: return None
+        result = subprocess.run(["wslpath", win_profile], capture_output=True, text=True)
+        return Path(result.stdout.strip()) if result.returncode == 0 else None
+    except OSError:
+        return None
+
+# === TRIVY ===
+@lru_cache(maxsize=None)
+def trivy_version():
+    """(major, minor) of the installed Trivy, asked once via `trivy --version`; None if unknown."""
+    try:
+        out = subprocess.run(["trivy", "--version"], capture_output=True, text=True, timeout=30).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = re.search(r"Version:\s*v?(\d+)\.(\d+)", out)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+def trivy_db_fresh():
+    """True if the cached vulnerability DB was updated less than TRIVY_DB_TTL ago."""
+    try:
+        return time.time() - (TRIVY_CACHE_DIR / "db" / "metadata.json").stat().st_mtime < TRIVY_DB_TTL
+    except OSError:
+        return False
 
 # === DATA CLASS FOR ARGS ===
 @dataclass
@@ -105,12 +528,16 @@ class ScanConfig:
     path: str = None
     light_scan: bool = False
     dry_run: bool = False
+    top_cves: int = None
+    no_cache: bool = False
+    trivy_server: str = None
+    min_severity: str = "UNKNOWN"
 
 class VulnixAutomator:
     def __init__(self, config: ScanConfig):
         self.config = config
         self.console = Console()
-        self.timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.timestamp = time.strftime("%Y%m%d_%H%M%S")
         self.output_dir = self._get_desktop_path()
         self.report_path = self.output_dir / f"VULNIX_report_{self.timestamp}.json"
         self.html_report_path = self.output_dir / f"VULNIX_Dashboard_{self.timestamp}.html"
@@ -118,13 +545,41 @@ class VulnixAutomator:
         self.api_key = self._load_api_key()
         
         # Configure Gemini
+        self.model = None
         if self.api_key:
-            genai.configure(api_key=self.api_key)
-            self.model_name = self._get_best_model()
-            self.model = genai.GenerativeModel(self.model_name)
+            configure_genai(self.api_key)
+            # list_models() is a network round-trip: resolve it in the background,
+            # hidden behind the (much longer) Trivy scan.
+            executor = ThreadPoolExecutor(max_workers=1)
+            self._model_future = executor.submit(self._get_best_model)
+            executor.shutdown(wait=False)
+
+    def _load_model(self):
+        """Returns the Gemini model, waiting for the background model selection if needed."""
+        if self.model is None:
+            self.model_name = self._model_future.result()
+            self.model = get_genai_model(self.model_name)
+        return self.model
+
+    def _cache_model(self, model_name):
+        """Persists the selected model name (atomic write) and returns it."""
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            with atomic_open(MODEL_CACHE_FILE) as f:
+                f.write(json_dumps({"model": model_name, "ts": time.time()}))
+        except OSError: pass
+        return model_name
 
     def _get_best_model(self):
         """Dynamically select the best available Gemini model."""
+        # A fresh cached choice avoids the list_models() HTTPS round-trip entirely.
+        try:
+            cached = json_loads(MODEL_CACHE_FILE.read_bytes())
+            if time.time() - cached["ts"] < MODEL_CACHE_TTL:
+                return cached["model"]
+        except (OSError, ValueError, KeyError, TypeError): pass
+
+        import google.generativeai as genai
         preferred_order = ["gemini-1.5-flash", "gemini-1.5-pro", "gemini-pro"]
         try:
             available_models = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
@@ -132,13 +587,13 @@ class VulnixAutomator:
             
             for preferred in preferred_order:
                 if preferred in clean_models:
-                    return preferred
+                    return self._cache_model(preferred)
             
             # Fallback: finding anything with "gemini"
             for m in clean_models:
                 if "gemini" in m:
                     self.console.print(f"[bold yellow]⚠ Fallback Model:[/bold yellow] {m}")
-                    return m
+                    return self._cache_model(m)
                     
             return "gemini-pro"
         except Exception as e:
@@ -147,16 +602,35 @@ class VulnixAutomator:
 
     def _get_desktop_path(self):
         """Finds Desktop path on Windows/WSL/Linux."""
-        if "WSL_DISTRO_NAME" in os.environ:
-            try:
-                cmd = "wslpath $(cmd.exe /c 'echo %USERPROFILE%')"
-                result = subprocess.run(cmd, capture_output=True, text=True, shell=True)
-                if result.returncode == 0:
-                    win_desktop = Path(result.stdout.strip()) / "Desktop"
-                    if win_desktop.exists(): return win_desktop
-            except: pass
-        linux_desktop = Path.home() / "Desktop"
-        return linux_desktop if linux_desktop.exists() else Path.home()
+        if IS_WSL:
+            # Cheap paths first: no cmd.exe/wslpath process when the profile is known.
+            # USERPROFILE is exported via WSLENV on many setups (C:\Users\x or /mnt/c/Users/x).
+            profile = os.environ.get("USERPROFILE", "")
+            if len(profile) > 2 and profile[1] == ":":
+                profile = f"/mnt/{profile[0].lower()}{profile[2:]}".replace("\\", "/")
+            candidates = [Path(profile) / "Desktop"] if profile.startswith("/") else []
+            if os.environ.get("USER"):
+                candidates.append(Path("/mnt/c/Users") / os.environ["USER"] / "Desktop")
+            for win_desktop in candidates:
+                if win_desktop.exists(): return win_desktop
+            profile = wsl_user_profile()
+            if profile:
+                if (profile / "Desktop").exists(): return profile / "Desktop"
+            else:
+                # Windows could not be asked: a single real profile with a Desktop is then
+                # unambiguous. Never tried once the profile is known, even if its Desktop is
+                # missing (OneDrive redirection): that would pick another account's Desktop.
+                # scandir gives the entry type for free (each stat crosses 9P on WSL).
+                desktops = []
+                try:
+                    with os.scandir("/mnt/c/Users") as it:
+                        for entry in it:
+                            if entry.name in WINDOWS_SYSTEM_PROFILES or not entry.is_dir(follow_symlinks=False): continue
+                            if os.path.isdir(os.path.join(entry.path, "Desktop")): desktops.append(entry.path)
+                except OSError: pass
+                if len(desktops) == 1: return Path(desktops[0]) / "Desktop"
+        linux_desktop = HOME / "Desktop"
+        return linux_desktop if linux_desktop.exists() else HOME
 
     def _load_api_key(self):
         """Loads API Key safely."""
@@ -178,7 +652,10 @@ class VulnixAutomator:
         Refresh sudo credentials explicitly before hiding output.
         Prevents the script from hanging on invisible password prompts.
         """
-        if platform.system() != "Windows":
+        if not IS_WINDOWS:
+            # Credentials still cached (sudo -n never prompts): nothing to refresh interactively.
+            if subprocess.run(["sudo", "-n", "-v"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
+                return
             try:
                 # sudo -v updates the user's cached credentials
                 subprocess.run(["sudo", "-v"], check=True)
@@ -186,360 +663,375 @@ class VulnixAutomator:
                 self.console.print("[bold red]❌ Sudo authentication failed. Exiting.[/bold red]")
                 sys.exit(1)
 
+    def _trivy_cmd(self, target_args, output=None, workers=1):
+        """Builds a Trivy fs command line writing its JSON report to `output` (stdout if None).
+
+        `workers` is the number of Trivy processes running at the same time.
+        """
+        cmd = ["trivy", "fs"] + target_args
+        if not IS_WINDOWS: cmd.insert(0, "sudo")
+        cmd += ["--scanners", "vuln", "--format", "json", "--timeout", "20m", "--quiet"]
+        # Analyze files with one goroutine per core, the cores being shared between the
+        # concurrent runs. Only passed when that beats Trivy's default of 5, and only on
+        # Trivy >= 0.50: older versions would reject the whole command.
+        cores_per_run = (os.cpu_count() or 1) // workers
+        if cores_per_run > 5 and (trivy_version() or (0, 0)) >= (0, 50):
+            cmd += ["--parallel", str(cores_per_run)]
+        if self.config.trivy_server:
+            # Client mode: a long-running "trivy server" keeps the DB loaded and warm,
+            # this process only sends the package metadata it found.
+            cmd += ["--server", self.config.trivy_server]
+        else:
+            # Explicit, stable cache dir (same under sudo or not); a recent DB skips the
+            # update check entirely.
+            cmd += ["--cache-dir", str(TRIVY_CACHE_DIR)]
+            # The fs scan cache is a BoltDB file with an exclusive lock: concurrent runs
+            # sharing it would serialize or fail ("cache may be in use by another
+            # process"). Each concurrent run gets its own in-memory scan cache instead;
+            # the vulnerability DB itself is still read from the shared cache dir.
+            cmd += ["--cache-backend", "memory" if workers > 1 else TRIVY_CACHE_BACKEND]
+            if trivy_db_fresh(): cmd.append("--skip-db-update")
+        if output: cmd += ["--output", str(output)]
+        return cmd
+
+    def _run_trivy(self, cmd):
+        """Runs a Trivy command, relaying its warnings/errors and forwarding Ctrl+C to it."""
+        # Trivy runs with --quiet: stderr only carries warnings and errors (DB download
+        # failures, skipped files), worth showing instead of discarding.
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace")
+        try:
+            for line in proc.stderr:
+                if line.strip(): self.console.log(Text(line.rstrip(), style="dim"))
+            returncode = proc.wait()
+        except KeyboardInterrupt:
+            # Don't leave an orphaned (sudo) trivy behind: stop it and wait for it.
+            proc.send_signal(signal.SIGINT)
+            proc.wait()
+            self.console.print("[bold yellow]Scan interrupted.[/bold yellow]")
+            sys.exit(130)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd)
+
+    def _scan_one(self, target, workers=1):
+        """Scans a single directory and returns the parsed report read from Trivy's stdout."""
+        # No temp file: the partial report never touches the disk, only the merged one does.
+        cmd = self._trivy_cmd([target], workers=workers)
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Same as _run_trivy: warnings/errors are relayed, tagged with the directory
+        # since several scans run at once.
+        for line in result.stderr.decode("utf-8", "replace").splitlines():
+            if line.strip(): self.console.log(Text(f"[{target}] {line.rstrip()}", style="dim"))
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, cmd, result.stdout, result.stderr)
+        return json_loads(result.stdout)
+
+    def _run_light_scan(self):
+        """Scans LIGHT_SCAN_DIRS concurrently and merges the results into one report."""
+        # /bin and /sbin are symlinks to /usr on merged-usr distros: scan each real dir once.
+        targets = list(dict.fromkeys(os.path.realpath(d) for d in LIGHT_SCAN_DIRS if os.path.isdir(d)))
+        # Independent processes, each with its own in-memory scan cache (see _trivy_cmd),
+        # so nothing is locked between them: wall time ~ the slowest directory, not the sum.
+        # Capped at the core count (each Trivy already uses several threads); at least 1
+        # worker so a host without any of the directories still gets an (empty) report.
+        workers = max(1, min(len(targets), os.cpu_count() or 1))
+        reports = iter(())
+        # Stale or missing DB: the first directory is scanned alone so the DB is downloaded
+        # once, instead of by every concurrent run into the same directory.
+        if targets and workers > 1 and not self.config.trivy_server and not trivy_db_fresh():
+            reports = iter((self._scan_one(targets[0]),))
+            targets = targets[1:]
+        with ThreadPoolExecutor(max_workers=workers) as executor, \
+                atomic_open(self.report_path) as f:
+            # Each partial report is written out as soon as it is merged: no merged dict,
+            # no single giant serialization of the whole thing.
+            # Merged in target order (not completion order): the same system always gives
+            # the same report, hence the same Gemini prompt and a fix-cache hit.
+            f.write('{"Results":[')
+            sep = ""
+            for report in itertools.chain(reports, executor.map(lambda t: self._scan_one(t, workers), targets)):
+                for res in report.get("Results") or []:
+                    f.write(sep)
+                    f.write(json_dumps(res))
+                    sep = ","
+            f.write("]}")
+
     def run_scan(self):
         """Executes the Trivy scan."""
         # 1. Ensure sudo access NOW (ask password if needed)
         self._ensure_sudo()
+        # Created as the invoking user, so ~/.cache/vulnix itself stays user-owned.
+        try: TRIVY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        except OSError: pass
 
-        cmd = ["trivy", "fs"]
-        if platform.system() != "Windows": cmd.insert(0, "sudo")
-
+        cmd = None
         target_desc = "Full System"
         if self.config.path:
-            cmd.append(self.config.path)
+            cmd = self._trivy_cmd([self.config.path], self.report_path)
             target_desc = f"Custom: {self.config.path}"
         elif self.config.light_scan:
             target_desc = "Light Scan (System Dirs)"
-            if platform.system() == "Windows":
-                cmd += ["C:\\", "--skip-dirs", "C:\\Windows\\Installer,C:\\Windows\\WinSxS"]
-            else:
-                cmd += ["/", "--skip-dirs", "/proc,/sys,/dev,/run,/var/lib,/var/log,/mnt,/snap"]
+            if IS_WINDOWS:
+                cmd = self._trivy_cmd(["C:\\", "--skip-dirs", "C:\\Windows\\Installer,C:\\Windows\\WinSxS"], self.report_path)
         else:
-            cmd.append("/") if platform.system() != "Windows" else cmd.append("C:\\")
-
-        cmd += ["--scanners", "vuln", "--format", "json", "--output", str(self.report_path), "--timeout", "20m"]
+            cmd = self._trivy_cmd(["C:\\"] if IS_WINDOWS else ["/", "--skip-dirs", SKIP_DIRS], self.report_path)
 
         self.console.print(f"\n[bold cyan]Target:[/bold cyan] {target_desc}")
         
         # 2. Run scan with spinner (safe now that sudo is cached)
         with self.console.status("[bold green]Running Trivy Scan (This may take a while)...[/bold green]", spinner="dots"):
             try:
-                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                if cmd is None:
+                    self._run_light_scan()
+                else:
+                    self._run_trivy(cmd)
             except subprocess.CalledProcessError:
                 self.console.print("[bold red]Scan Failed![/bold red]")
                 sys.exit(1)
         
         self.console.print(f"[bold green]✔ Scan Complete![/bold green] Report saved to: [underline]{self.report_path}[/underline]")
 
+    def _iter_vulnerabilities(self):
+        """Streams the Trivy report and yields a compact dict per vulnerability."""
+        # ijson parses one Result at a time: the full report (can be 100+ MB on "/")
+        # is never materialized, only the fields we actually use are kept.
+        with open(self.report_path, "rb") as f:
+            for res in ijson.items(f, "Results.item", use_float=True):
+                target = res.get("Target", "Unknown Target")
+                for vuln in res.get("Vulnerabilities") or []:
+                    cvss = vuln.get("CVSS") or {}
+                    yield {
+                        "Target": target,
+                        "VulnerabilityID": vuln.get("VulnerabilityID", "N/A"),
+                        "Severity": _SEV_CANON.get((vuln.get("Severity") or "UNKNOWN").upper(), "UNKNOWN"),
+                        "Score": max((src.get("V3Score", 0) for src in cvss.values()), default=0),
+                        "PkgName": vuln.get("PkgName", "N/A"),
+                        "Type": res.get("Type", ""),
+                        "InstalledVersion": vuln.get("InstalledVersion", "N/A"),
+                        "FixedVersion": vuln.get("FixedVersion", "N/A"),
+                        "Title": vuln.get("Title", "No Description"),
+                    }
+
     def analyze_report(self):
         """Parses the JSON report and displays a summary table."""
-        with open(self.report_path) as f:
-            report = json.load(f)
-        
-        stats = {"total": 0, "critical": 0, "high": 0, "medium": 0, "low": 0}
-        for res in report.get("Results", []):
-            for vuln in res.get("Vulnerabilities", []):
-                stats["total"] += 1
-                sev = vuln.get("Severity", "UNKNOWN").lower()
-                if sev in stats: stats[sev] += 1
+        # The same histogram feeds this table and the HTML dashboard. Counter runs its
+        # counting loop in C (missing severities read as 0).
+        vulnerabilities = list(self._iter_vulnerabilities())
+        stats = Counter(vuln["Severity"] for vuln in vulnerabilities)
+        total = len(vulnerabilities)
 
         # Pretty Table Output
         table = Table(title="Vulnerability Summary", border_style="blue")
         table.add_column("Severity", style="bold")
         table.add_column("Count", justify="right")
         
-        table.add_row("[bold red]CRITICAL[/bold red]", str(stats["critical"]))
-        table.add_row("[red]HIGH[/red]", str(stats["high"]))
-        table.add_row("[yellow]MEDIUM[/yellow]", str(stats["medium"]))
-        table.add_row("[green]LOW[/green]", str(stats["low"]))
-        table.add_row("[bold white]TOTAL[/bold white]", str(stats["total"]))
+        # Counts are stringified once and shared by this table and the HTML dashboard.
+        counts = {sev: str(stats[sev]) for sev in ("CRITICAL", "HIGH", "MEDIUM", "LOW")}
+        counts["TOTAL"] = str(total)
+        counts["MEDIUM_LOW"] = str(stats["MEDIUM"] + stats["LOW"])
+        for sev, label in _SEV_LABELS.items():
+            table.add_row(label, counts[sev])
         
         self.console.print(table)
         
-        if stats["total"] == 0:
+        if total == 0:
             self.console.print(Panel("[bold green]System is CLEAN! No vulnerabilities found.[/bold green]", border_style="green"))
             sys.exit(0)
             
-        return report
+        return counts, vulnerabilities
 
-    def generate_html_report(self, report_data):
+    def generate_html_report(self, stats, vulnerabilities):
         """Generates a self-contained HTML Executive Dashboard."""
-        
-        # Calculate stats for the chart
-        stats = {"CRITICAL": 0, "HIGH": 0, "MEDIUM": 0, "LOW": 0, "UNKNOWN": 0}
-        vulnerabilities = []
-        
-        for res in report_data.get("Results", []):
-            target = res.get("Target", "Unknown Target")
-            for vuln in res.get("Vulnerabilities", []):
-                sev = vuln.get("Severity", "UNKNOWN").upper()
-                if sev in stats: stats[sev] += 1
-                else: stats["UNKNOWN"] += 1
-                
-                vulnerabilities.append({
-                    "id": vuln.get("VulnerabilityID", "N/A"),
-                    "pkg": vuln.get("PkgName", "N/A"),
-                    "severity": sev,
-                    "title": vuln.get("Title", "No Description"),
-                    "version": vuln.get("InstalledVersion", "N/A"),
-                    "fixed_in": vuln.get("FixedVersion", "N/A"),
-                    "target": target
-                })
-
-        HTML_TEMPLATE = """
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>VULNIX Executive Dashboard</title>
-            <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-            <style>
-                :root { --bg: #0f172a; --card-bg: #1e293b; --text: #f8fafc; --accent: #3b82f6; --critical: #ef4444; --high: #f97316; --medium: #eab308; --low: #22c55e; }
-                body { font-family: 'Segoe UI', system-ui, sans-serif; background: var(--bg); color: var(--text); margin: 0; padding: 20px; }
-                .container { max-width: 1200px; margin: 0 auto; }
-                .header { display: flex; justify-content: space-between; align-items: center; margin-bottom: 30px; border-bottom: 2px solid var(--accent); padding-bottom: 10px; }
-                .grid { display: grid; grid-template-columns: 1fr 2fr; gap: 20px; margin-bottom: 30px; }
-                .card { background: var(--card-bg); padding: 20px; border-radius: 12px; box-shadow: 0 4px 6px -1px rgba(0,0,0,0.5); }
-                .stat-card { text-align: center; padding: 15px; background: rgba(255,255,255,0.05); border-radius: 8px; margin-bottom: 10px; }
-                .stat-num { font-size: 2em; font-weight: bold; }
-                .vuln-table { width: 100%; border-collapse: collapse; margin-top: 20px; }
-                .vuln-table th, .vuln-table td { text-align: left; padding: 12px; border-bottom: 1px solid #334155; }
-                .vuln-table th { background: #334155; color: white; cursor: pointer; }
-                .badge { padding: 4px 8px; border-radius: 4px; font-size: 0.85em; font-weight: bold; color: #000; }
-                .bg-CRITICAL { background: var(--critical); } .bg-HIGH { background: var(--high); }
-                .bg-MEDIUM { background: var(--medium); } .bg-LOW { background: var(--low); }
-                input#search { width: 100%; padding: 10px; border-radius: 6px; border: 1px solid #475569; background: #0f172a; color: white; margin-bottom: 10px; }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>🛡 VULNIX Executive Report</h1>
-                    <p>{{ timestamp }}</p>
-                </div>
+        # Stats and rows come straight from analyze_report: no second walk of the report.
+        # Rows are a generator and stream().dump() writes each one as it is rendered:
+        # the page body is never built as a single string.
+        with atomic_open(self.html_report_path) as f:
+            get_html_template().stream(
+                timestamp=self.timestamp,
+                stats=stats,
+                rows=render_html_rows(vulnerabilities)
+            ).dump(f)
+            
+        self.console.print(Panel(f"[bold green]HTML Dashboard Generated![/bold green]\n[underline]{self.html_report_path}[/underline]", border_style="cyan"))
 
-                <div class="grid">
-                    <div class="card">
-                        <h3>Vulnerability Overview</h3>
-                        <canvas id="vulnChart"></canvas>
-                    </div>
-                    <div class="card">
-                        <h3>Summary</h3>
-                        <div class="stat-card">
-                            <div class="stat-num" style="color: var(--critical)">{{ stats.CRITICAL }}</div>
-                            <div>Critical Issues</div>
-                        </div>
-                        <div class="stat-card">
-                            <div class="stat-num" style="color: var(--high)">{{ stats.HIGH }}</div>
-                            <div>High Priority</div>
-                        </div>
-                        <div class="stat-card">
-                            <div class="stat-num">{{ stats.MEDIUM + stats.LOW }}</div>
-                            <div>Other Risks</div>
-                        </div>
-                    </div>
-                </div>
+    def _check_prompt_size(self, prompt):
+        """Returns False if the prompt is too large for the model's context window."""
+        # Cheap estimate (~3.5 bytes/token for Trivy JSON). Gemini's count_tokens costs a
+        # network round-trip, so it is only used when the estimate is too close to call.
+        tokens = int((len(FIX_SYSTEM_PROMPT) + len(prompt.encode("utf-8"))) / 3.5)
+        label = "estimated"
+        if MAX_INPUT_TOKENS * 0.85 <= tokens <= MAX_INPUT_TOKENS * 1.15:
+            try:
+                tokens = self.model.count_tokens(prompt).total_tokens
+                label = "exact"
+            except Exception: pass
 
-                <div class="card">
-                    <h3>Detailed Findings</h3>
-                    <input type="text" id="search" placeholder="Search vulnerabilities..." onkeyup="searchTable()">
-                    <table class="vuln-table" id="vulnTable">
-                        <thead>
-                            <tr onclick="sortTable(0)"><th>ID</th><th>Severity</th><th>Package</th><th>Version</th><th>Title</th></tr>
-                        </thead>
-                        <tbody>
-                            {% for v in vulnerabilities %}
-                            <tr>
-                                <td>{{ v.id }}</td>
-                                <td><span class="badge bg-{{ v.severity }}">{{ v.severity }}</span></td>
-                                <td>{{ v.pkg }}</td>
-                                <td>{{ v.version }}</td>
-                                <td>{{ v.title }}</td>
-                            </tr>
-                            {% endfor %}
-                        </tbody>
-                    </table>
-                </div>
-            </div>
+        if tokens > MAX_INPUT_TOKENS:
+            self.console.print(f"[bold red]Prompt too large for Gemini (~{tokens} tokens, limit {MAX_INPUT_TOKENS}). Try --top-cves N or a Custom/Light scan.[/bold red]")
+            return False
+        self.console.print(f"[dim]Prompt size: {tokens} tokens ({label})[/dim]")
+        return True
 
-            <script>
-                // Pie Chart
-                const ctx = document.getElementById('vulnChart').getContext('2d');
-                new Chart(ctx, {
-                    type: 'doughnut',
-                    data: {
-                        labels: ['Critical', 'High', 'Medium', 'Low'],
-                        datasets: [{
-                            data: [{{ stats.CRITICAL }}, {{ stats.HIGH }}, {{ stats.MEDIUM }}, {{ stats.LOW }}],
-                            backgroundColor: ['#ef4444', '#f97316', '#eab308', '#22c55e'],
-                            borderWidth: 0
-                        }]
-                    },
-                    options: { plugins: { legend: { position: 'bottom', labels: { color: 'white' } } } }
-                });
-
-                // Search Function
-                function searchTable() {
-                    const input = document.getElementById("search");
-                    const filter = input.value.toUpperCase();
-                    const table = document.getElementById("vulnTable");
-                    const tr = table.getElementsByTagName("tr");
-                    for (let i = 1; i < tr.length; i++) {
-                        tr[i].style.display = tr[i].textContent.toUpperCase().includes(filter) ? "" : "none";
-                    }
-                }
-            </script>
-        </body>
-        </html>
-        """
-        
-        template = Template(HTML_TEMPLATE)
-        html_content = template.render(
-            timestamp=self.timestamp,
-            stats=stats,
-            vulnerabilities=vulnerabilities
-        )
-        
-        with open(self.html_report_path, "w", encoding="utf-8") as f:
-            f.write(html_content)
-            
-        self.console.print(Panel(f"[bold green]HTML Dashboard Generated![/bold green]\n[underline]{self.html_report_path}[/underline]", border_style="cyan"))
+    def _fixable(self, vulnerabilities):
+        """Yields the CVEs the fix script can act on: a fixed version exists, severity >= --min-severity."""
+        min_rank = SEVERITY_RANK[self.config.min_severity]
+        for v in vulnerabilities:
+            if v["FixedVersion"] not in ("", "N/A") and SEVERITY_RANK[v["Severity"]] >= min_rank:
+                yield v
+
+    def _fix_payload(self, vulnerabilities):
+        """Keeps only what the fix script needs: host OS + one upgrade target per package."""
+        # Titles, scores and unfixable CVEs don't change the script but dominate the
+        # token count (latency + cost of the Gemini call). A package is often listed
+        # under dozens of CVEs: only its highest fixed version / severity is sent.
+        upgrades = {}
+        for v in self._fixable(vulnerabilities):
+            # Per ecosystem: a pip and a deb package with the same name are distinct upgrades
+            key = (v["Type"], v["PkgName"])
+            entry = upgrades.get(key)
+            if entry is None:
+                upgrades[key] = {"target": v["Target"], "type": v["Type"], "pkg": v["PkgName"], "inst": v["InstalledVersion"],
+                                 "fix": v["FixedVersion"], "sev": v["Severity"], "cves": [v["VulnerabilityID"]]}
+                continue
+            entry["cves"].append(v["VulnerabilityID"])
+            if _version_key(v["FixedVersion"], v["Type"]) > _version_key(entry["fix"], v["Type"]):
+                entry["fix"], entry["target"] = v["FixedVersion"], v["Target"]
+            if SEVERITY_RANK[v["Severity"]] > SEVERITY_RANK[entry["sev"]]:
+                entry["sev"] = v["Severity"]
+        return {"os": platform.platform(), "vulns": list(upgrades.values())}
 
-    def generate_fix(self, report_data):
+    def request_fix(self, report_data):
+        """Builds the prompt, asks for confirmation and starts the Gemini call in the background."""
         if not self.api_key:
             self.console.print("[bold yellow]⚠ No Gemini API Key found. Skipping auto-fix generation.[/bold yellow]")
             return None
 
-        # --- INTELLIGENCE V3 : DÉDOUBLONNAGE + RECHERCHE DE FICHIER ---
-        system_instruction = """
-        You are an expert Senior Linux System Administrator.
-        Your task is to generate a ROBUST Bash script to remediate vulnerabilities found in a Trivy JSON scan.
+        # Only the N highest-scored CVEs go to Gemini: O(N log K) heap, no full sort.
+        # Picked among the fixable ones, or unfixable CVEs would take slots and be dropped.
+        if self.config.top_cves:
+            report_data = heapq.nlargest(self.config.top_cves, self._fixable(report_data), key=lambda v: v["Score"])
 
-        ### INPUT CONTEXT
-        The script will receive the path to the Trivy JSON report as the first argument ($1).
+        self._load_model()
+        payload = self._fix_payload(report_data)
+        if self.config.top_cves:
+            self.console.print(f"[dim]Sending the top {len(report_data)} fixable CVEs (by CVSS score, {len(payload['vulns'])} packages) to Gemini.[/dim]")
+        full_prompt = f"Here are the vulnerabilities extracted from the Trivy Scan Report (analyze them, but do not embed them):\n{json_dumps(payload)}"
+        
+        self.console.print(f"\n[bold purple]AI Analysis[/bold purple]: Using model [cyan]{self.model_name}[/cyan]")
 
-        ### REQUIREMENTS:
-        1. **SCRIPT HEADER**:
-           - Start with `#!/bin/bash`.
-           - Use `set -eo pipefail` (NO `set -u`).
-           - Wrap logic in `main()`.
+        # Same model + instructions + vulnerability list -> same script: reuse it instead
+        # of paying another API call. Changing the model or the prompt invalidates it.
+        cache_key = hashlib.sha256("\0".join((self.model_name, FIX_SYSTEM_PROMPT, full_prompt)).encode("utf-8")).hexdigest()
+        cache_file = FIX_CACHE_DIR / f"{cache_key}.sh"
 
-        2. **PYTHON PARSING (THE BRAIN)**: 
-           - Use `python3 - "$1" <<EOF` to pass the filename.
-           - **LOGIC CHANGE - DEDUPLICATION**: 
-             - You must parse ALL vulnerabilities.
-             - Store them in a dictionary: `updates[package_name] = (max_fixed_version, target_file)`.
-             - Only keep the HIGHEST version required for each package to avoid multiple useless updates.
-             - Print the unique list: `pkg|ver|file`.
-           - **Syntax**: Use `f"{chr(44).join(list)}"` for output.
+        if not self._check_prompt_size(full_prompt):
+            return None
+        
+        if not self.config.dry_run:
+            import questionary
+            if not questionary.confirm("Do you want Gemini to generate a fix script?").ask():
+                self.console.print("[yellow]Skipping AI generation.[/yellow]")
+                return None
 
-        3. **REMEDIATION LOOP**:
-           - Loop through the **unique** list.
-           - `python3 -m pip install --upgrade --break-system-packages --ignore-installed "${pkg}==${ver}"`.
-           - Track success (`UPDATED_PACKAGES`) and failure (`MANUAL_ACTION_REQUIRED`).
+        # Looked up after the confirmation: answering "No" never writes a script, cached or not.
+        if not self.config.no_cache and cache_file.exists():
+            # Unreadable cache entry: fall through to a fresh request.
+            try:
+                cached_script = cache_file.read_text()
+            except OSError:
+                cached_script = None
+            if cached_script:
+                self.console.print(f"[bold green]✔ Reusing cached fix script[/bold green] ({cache_file})")
+                fix_request = Future()
+                fix_request.set_result(cached_script)
+                return fix_request
 
-        4. **SMART FILE FINDER (The Limier)**:
-           - After update, verify persistence in `$target_file`.
-           - **CRITICAL LOGIC**: 
-             - If `[ ! -f "$target_file" ]`, try to find it!
-             - Run: `found_file=$(find . -type f -name "$(basename "$target_file")" -print -quit)`
-             - If found, use `$found_file` as the new target.
-             - If still not found, try searching inside `/home/$USER/`.
-           - Once file is located, `grep` for the old version.
-           - If old version exists in file -> Add to `MANUAL_ACTION_REQUIRED`.
+        # The request runs while the caller does local work (HTML dashboard): the
+        # Gemini round-trip (seconds) overlaps disk I/O instead of following it.
+        executor = ThreadPoolExecutor(max_workers=1)
+        fix_request = executor.submit(self._ask_gemini, full_prompt, cache_file)
+        executor.shutdown(wait=False)
+        return fix_request
 
-        5. **FINAL REPORT**:
-           - Print "REMEDIATION SUMMARY".
-           - List runtime successes.
-           - List persistence mismatches explicitly: "⚠️  File [path] still contains [pkg] [old_ver]".
+    def _ask_gemini(self, prompt, cache_file):
+        """Calls Gemini, strips Markdown fences and stores the script in the cache."""
+        response = self.model.generate_content(prompt, request_options={"timeout": GEMINI_TIMEOUT})
+        script_content = response.text.strip()
+        # Markdown fences: slice them off the blob, no split/join of every line.
+        if script_content.startswith("```"):
+            nl = script_content.find("\n")
+            script_content = script_content[nl + 1:] if nl != -1 else ""
+            if script_content.endswith("```"): script_content = script_content[:-3].rstrip()
+        # Never cache an empty answer: every later run would reuse it instead of asking again.
+        if not script_content.strip():
+            raise ValueError("Gemini returned an empty script")
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with atomic_open(cache_file) as f:
+                f.write(script_content)
+        except OSError: pass
+        return script_content
 
-        6. **OUTPUT**:
-           - Return ONLY the raw Bash script.
-        """
-        
-        full_prompt = f"{system_instruction}\n\nHere is the Trivy Scan Report content to analyze (but do not embed it):\n{json.dumps(report_data)}"
-        
-        self.console.print(f"\n[bold purple]AI Analysis[/bold purple]: Using model [cyan]{self.model_name}[/cyan]")
-        
-        if not self.config.dry_run and not questionary.confirm("Do you want Gemini to generate a fix script?").ask():
-            self.console.print("[yellow]Skipping AI generation.[/yellow]")
+    def generate_fix(self, fix_request):
+        """Waits for the Gemini response started by request_fix and returns the Bash script."""
+        if fix_request is None:
             return None
 
         with self.console.status("[bold purple]Gemini is thinking (Optimizing & Deduplicating)...[/bold purple]", spinner="earth"):
             try:
-                response = self.model.generate_content(full_prompt)
-                script_content = response.text.strip()
-                if script_content.startswith("```"):
-                    lines = script_content.splitlines()
-                    if lines[0].startswith("```"): lines = lines[1:]
-                    if lines and lines[-1].startswith("```"): lines = lines[:-1]
-                    script_content = "\n".join(lines)
-                return script_content
+                return fix_request.result()
             except Exception as e:
                 self.console.print(f"[bold red]API Error: {e}[/bold red]")
                 return None
             
+    def _dry_run_lines(self, content):
+        """Yields the script lines, wrapping dangerous top-level commands in a confirmation."""
+        lines = content.splitlines()
+        # The helper goes right after the shebang (if any), before any wrapped command.
+        start = 1 if lines and lines[0].startswith("#!") else 0
+        yield from lines[:start]
+        yield DRY_RUN_HELPER
+        for line in lines[start:]:
+            l = line.strip()
+            should_wrap = False
+            
+            # Vérifications 1 et 2 : ligne vide, commentaire, ou ligne indentée ?
+            # (On ne touche pas au code dans les fonctions/boucles)
+            if _KEEP_LINE_RE.match(line):
+                should_wrap = False
+                
+            # Vérification 3 : La ligne est-elle "Pure" ? (Pas de caractères complexes)
+            elif _COMPLEX_RE.search(l):
+                should_wrap = False
+                
+            else:
+                # Vérification 4 : Est-ce une commande dangereuse ?
+                if _DANGEROUS_RE.match(l):
+                    should_wrap = True
+                
+                # Vérification 5 : Redirection destructrice simple (ex: echo "x" > file)
+                if " > " in l and not " >> " in l:
+                    should_wrap = True
+
+            if should_wrap:
+                # shlex.quote: eval re-runs the exact line (quotes, redirections included)
+                yield f'vulnix_ask {shlex.quote(l)} "$@"'
+            else:
+                yield line
+
     def save_script(self, content):
         """Saves the generated script to disk with optional Dry-Run wrappers."""
         if not content: return
 
+        # Lines are streamed straight to the file: the wrapped script is never built in memory.
+        lines = (content,)
         if self.config.dry_run:
             self.console.print("[italic]Adding Dry-Run safeguards (Paranoid Mode)...[/italic]")
-            lines = content.splitlines()
-            new_lines = []
-            
-            # 1. Liste des commandes à surveiller
-            DANGEROUS_COMMANDS = [
-                "apt-get", "apt", "yum", "dnf", "apk", "pacman", "zypper",
-                "rm ", "mv ", "cp ", "sed ", "chmod ", "chown ", "dd ",
-                "systemctl", "service", "pip ", "npm ", "yarn ", "poetry ",
-                "wget", "curl", "dpkg", "rpm"
-            ]
-
-            # 2. Liste des caractères qui signalent une complexité
-            # Si une ligne contient l'un de ces caractères, on ne la touche pas pour éviter les erreurs de syntaxe.
-            # ; = fin de commande
-            # | = pipe
-            # & = logique
-            # ( ) = sous-shell
-            # \ = multiligne
-            # { } = bloc
-            COMPLEX_MARKERS = [";", "|", "&", "(", ")", "{", "}", "\\", "`", "if ", "then", "else", "elif", "fi", "do", "done", "case", "esac"]
-
-            for line in lines:
-                l = line.strip()
-                should_wrap = False
-                
-                # Vérification 1 : Est-ce une ligne vide ou un commentaire ?
-                if not l or l.startswith("#"):
-                    should_wrap = False
-                
-                # Vérification 2 : Est-ce une ligne indentée ? (On ne touche pas au code dans les fonctions/boucles)
-                elif line.startswith(" ") or line.startswith("\t"):
-                    should_wrap = False
-                    
-                # Vérification 3 : La ligne est-elle "Pure" ? (Pas de caractères complexes)
-                elif any(marker in l for marker in COMPLEX_MARKERS):
-                    should_wrap = False
-                    
-                else:
-                    # Vérification 4 : Est-ce une commande dangereuse ?
-                    for cmd in DANGEROUS_COMMANDS:
-                        if l.startswith(cmd):
-                            should_wrap = True
-                            break
-                    
-                    # Vérification 5 : Redirection destructrice simple (ex: echo "x" > file)
-                    if " > " in l and not " >> " in l:
-                        should_wrap = True
-
-                if should_wrap:
-                    # On échappe les guillemets pour le read -p
-                    safe_l = l.replace('"', '\\"').replace("'", "")
-                    new_lines.append(f'read -p "[DRY-RUN] Execute: {safe_l}? [y/N] " confirm')
-                    new_lines.append('if [[ $confirm == [yY] || $confirm == [yY]es ]]; then')
-                    new_lines.append(f'    {line}')
-                    new_lines.append('fi')
-                else:
-                    new_lines.append(line)
-            content = "\n".join(new_lines)
+            lines = self._dry_run_lines(content)
 
-        with open(self.fix_script_path, "w") as f:
+        # Executable bit is set on the temp file: the script never exists half-written.
+        with atomic_open(self.fix_script_path, 0o755) as f:
             if not content.startswith("#!"): f.write("#!/bin/bash\n")
-            f.write(content)
-        
-        os.chmod(self.fix_script_path, 0o755)
+            f.writelines(line + "\n" for line in lines)
         
         self.console.print(Panel(
             f"[bold green]Remediation Script Generated Successfully![/bold green]\n\n"
@@ -555,6 +1047,7 @@ def show_banner():
     console.clear()
     
     # ASCII Art Title
+    import pyfiglet
     font = pyfiglet.figlet_format(TOOL_NAME, font="slant")
     
     # Styled Panel
@@ -567,6 +1060,7 @@ def show_banner():
     console.print(panel)
 
 def interactive_menu():
+    import questionary
     style = questionary.Style([
         ('qmark', 'fg:#673ab7 bold'),
         ('question', 'bold'),
@@ -594,6 +1088,14 @@ def interactive_menu():
 
 # === MAIN ===
 
+def positive_int(value):
+    """argparse type: an integer >= 1."""
+    try: number = int(value)
+    except ValueError: number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, got {value!r}")
+    return number
+
 def main():
     # Check if arguments provided via CLI (Automation Mode)
     if len(sys.argv) > 1:
@@ -601,9 +1103,16 @@ def main():
         parser.add_argument("--dry-run", action="store_true")
         parser.add_argument("--light-scan", action="store_true")
         parser.add_argument("--path", type=str)
+        parser.add_argument("--top-cves", type=positive_int, help="Only send the N highest-scored CVEs to Gemini")
+        parser.add_argument("--no-cache", action="store_true", help="Always ask Gemini, ignore cached fix scripts")
+        parser.add_argument("--trivy-server", type=str, default=os.environ.get("TRIVY_SERVER"),
+                            help="Scan through a running 'trivy server' (e.g. http://127.0.0.1:4954)")
+        parser.add_argument("--min-severity", type=str.upper, default="UNKNOWN", choices=sorted(SEVERITY_RANK, key=SEVERITY_RANK.get),
+                            help="Only send fixable CVEs at or above this severity to Gemini (e.g. HIGH)")
         args = parser.parse_args()
         
-        config = ScanConfig(path=args.path, light_scan=args.light_scan, dry_run=args.dry_run)
+        config = ScanConfig(path=args.path, light_scan=args.light_scan, dry_run=args.dry_run, top_cves=args.top_cves,
+                            no_cache=args.no_cache, trivy_server=args.trivy_server, min_severity=args.min_severity)
         app = VulnixAutomator(config)
         
     else:
@@ -618,20 +1127,22 @@ def main():
         light = False
         
         if "Custom" in action:
+            import questionary
             path = questionary.path("Enter target directory path:").ask()
             if not path: sys.exit(0)
         elif "Light" in action:
             light = True
             
-        config = ScanConfig(path=path, light_scan=light, dry_run=dry_run)
+        config = ScanConfig(path=path, light_scan=light, dry_run=dry_run, trivy_server=os.environ.get("TRIVY_SERVER"))
         app = VulnixAutomator(config)
 
     # Execution Flow
     app.check_dependencies()
     app.run_scan()
-    report_data = app.analyze_report()
-    app.generate_html_report(report_data)
-    fix_script = app.generate_fix(report_data)
+    stats, report_data = app.analyze_report()
+    fix_request = app.request_fix(report_data)
+    app.generate_html_report(stats, report_data)
+    fix_script = app.generate_fix(fix_request)
     app.save_script(fix_script)
 
 if __name__ == "__main__":